@@ -1,14 +1,17 @@
 import streamlit as st
-import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
-import mplfinance as mpf
-import matplotlib.pyplot as plt
+import bisect
+import hmac
+import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from io import BytesIO
 from portfolio_manager import PortfolioManager
+from renko import renko_brick_size, get_renko_bricks
 from data_fetcher import (
-    get_historical_data, get_current_price, get_stock_fundamentals,
-    calculate_sma, get_nifty_500_symbols, extract_symbol
+    get_historical_data, get_current_price, get_current_prices, get_stock_fundamentals,
+    calculate_smas, get_nifty_500_symbols, extract_symbol, prefetch, get_latest_volumes,
+    price_cache_key, _fetch_current_price, _fetch_historical_data
 )
 
 # Page config
@@ -20,10 +23,16 @@ st.set_page_config(
 )
 
 # Password protection
+@st.cache_resource
+def get_app_password():
+    """Read the app password from secrets once per process"""
+    return st.secrets.get("password", "trading123")
+
 def check_password():
     """Returns True if user entered correct password."""
     def password_entered():
-        if st.session_state["password"] == st.secrets.get("password", "trading123"):
+        entered = st.session_state["password"].encode()
+        if hmac.compare_digest(entered, get_app_password().encode()):
             st.session_state["password_correct"] = True
             del st.session_state["password"]
         else:
@@ -94,62 +103,151 @@ def init_portfolio():
 
 portfolio = init_portfolio()
 
+# Portfolio reads are cached per portfolio version, which every write bumps,
+# so reruns without a trade or import don't go back to the database
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_holdings(version):
+    return portfolio.get_holdings()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_orders(version):
+    return portfolio.get_orders()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_cash_balance(version):
+    return portfolio.get_cash_balance()
+
+# Load the symbol list once per rerun; both the Trade and Analysis tabs share it
+all_symbols = get_nifty_500_symbols()
+
+# Holdings are read once per rerun; orders and imports call st.rerun() after writing
+holdings_df = load_holdings(portfolio.version)
+
+TABS = ["🔄 Trade", "💼 Holdings", "📋 Order Book", "📊 Analysis"]
+TRADE_TAB = TABS[0]
+
+# Warm the caches for the sidebar prices and the Trade tab chart concurrently
+# instead of fetching them one after another further down the script
+holding_symbols = tuple(sorted(holdings_df['symbol'].unique()))
+calls = [(get_current_prices, holding_symbols)] if holding_symbols else []
+
+# Only the open tab is rendered, and the Trade tab is open until the user switches
+if st.session_state.get("active_tab", TRADE_TAB) == TRADE_TAB:
+    trade_symbol = extract_symbol(
+        st.session_state.get("trade_symbol", st.session_state.get("_trade_symbol", all_symbols[0]))
+    )
+    calls += [
+        (_fetch_current_price, trade_symbol, price_cache_key()),
+        (_fetch_historical_data, trade_symbol, "1y"),
+    ]
+prefetch(calls)
+
 # Helper functions
+# Indian Rupee units: thresholds for 1 lakh and 1 crore, with the divisor and
+# format used at or above each threshold (index 0 is plain rupees)
+INR_THRESHOLDS = np.array([100000, 10000000])
+INR_DIVISORS = np.array([1, 100000, 10000000])
+INR_FORMATS = ("₹{:,.2f}", "₹{:.2f}L", "₹{:.2f}Cr")
+
 def format_inr(amount):
     """Format amount in Indian Rupee format"""
-    if amount >= 10000000:  # 1 crore
-        return f"₹{amount/10000000:.2f}Cr"
-    elif amount >= 100000:  # 1 lakh
-        return f"₹{amount/100000:.2f}L"
-    else:
-        return f"₹{amount:,.2f}"
+    # Pick the unit by magnitude so losses get the same lakh/crore suffix as gains
+    idx = bisect.bisect_right(INR_THRESHOLDS, abs(amount))
+    return INR_FORMATS[idx].format(amount / INR_DIVISORS[idx])
+
+# Streamlit drops the state of widgets that aren't rendered in a run, which is
+# every widget in a closed tab. Keyed widgets are restored from a copy kept
+# under "_<key>" so selections survive switching tabs
+def restore_widget(key, default):
+    """Restore a widget's value from its saved copy before the widget is created"""
+    if key not in st.session_state:
+        st.session_state[key] = st.session_state.get(f"_{key}", default)
+
+def remember_widget(key):
+    """Save a widget's value so restore_widget can bring it back"""
+    st.session_state[f"_{key}"] = st.session_state[key]
+
+def format_percent(ratio):
+    """Format a ratio as a percentage"""
+    return f"{ratio*100:.2f}%"
+
+# Fundamentals shown in the Analysis tab as (key, label, formatter), one list per column
+FUNDAMENTAL_METRICS = [
+    [('pe_ratio', "P/E Ratio", "{:.2f}".format), ('market_cap', "Market Cap", format_inr)],
+    [('pb_ratio', "P/B Ratio", "{:.2f}".format), ('roe', "ROE", format_percent)],
+    [('debt_equity', "Debt/Equity", "{:.2f}".format), ('dividend_yield', "Dividend Yield", format_percent)],
+    [('week_52_high', "52W High", "₹{:.2f}".format), ('week_52_low', "52W Low", "₹{:.2f}".format)],
+]
 
 def calculate_portfolio_value(holdings_df, current_prices):
     """Calculate total portfolio value"""
-    total_value = 0
-    for _, row in holdings_df.iterrows():
-        current_price = current_prices.get(row['symbol'], 0)
-        total_value += row['quantity'] * current_price
-    return total_value
+    return float((holdings_df['quantity'] * holdings_df['symbol'].map(current_prices).fillna(0)).sum())
+
+def chart_data_key(data):
+    """Cheap cache key for chart data: its last bar and length instead of every row"""
+    return (data.index[-1] if len(data) else None, len(data))
+
+def figure_to_png(fig):
+    """Render a figure to PNG bytes and free it"""
+    import matplotlib.pyplot as plt
 
+    buf = BytesIO()
+    try:
+        fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    finally:
+        # pyplot keeps every figure alive until it is closed
+        plt.close(fig)
+    return buf.getvalue()
+
+# Volatile stocks can form over a thousand 1% bricks in a year; only the most
+# recent ones are drawn, which keeps render time flat and the chart readable
+MAX_RENKO_BRICKS = 300
+
+# Charts are cached, so reruns that don't touch a chart skip re-plotting it
+@st.cache_data(ttl=900, hash_funcs={pd.DataFrame: chart_data_key})
 def create_renko_chart(data, symbol, brick_size_pct=1.0):
-    """Create Renko chart using mplfinance"""
+    """Create Renko chart as a Plotly figure, with each brick drawn as a floating bar"""
     if data is None or data.empty:
         return None
     
     try:
-        # Prepare data for mplfinance - flatten multi-level columns if needed
-        ohlcv = data.copy()
-        
-        # If columns are multi-level, flatten them
-        if isinstance(ohlcv.columns, pd.MultiIndex):
-            ohlcv.columns = ohlcv.columns.droplevel(1)
-        
-        # Ensure we have the right columns
-        required_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
-        if not all(col in ohlcv.columns for col in required_cols):
-            st.error(f"Missing required columns. Available: {ohlcv.columns.tolist()}")
-            return None
-        
-        # Select only OHLCV columns
-        ohlcv = ohlcv[required_cols]
-        
         # Calculate brick size based on current price
-        current_price = float(ohlcv['Close'].iloc[-1])
-        brick_size = current_price * (brick_size_pct / 100)
+        current_price = float(data['Close'].iloc[-1])
+        brick_size = renko_brick_size(current_price, brick_size_pct)
         
-        # Renko parameters
-        renko_params = dict(brick_size=brick_size)
-        
-        # Create the plot without ax parameter
-        fig, axes = mpf.plot(
-            ohlcv,
-            type="renko",
-            renko_params=renko_params,
-            style="charles",
+        bricks = get_renko_bricks(data['Close'], brick_size)
+        if bricks.empty:
+            return None
+        bricks = bricks.iloc[-MAX_RENKO_BRICKS:]
+        
+        # Bricks sit side by side regardless of date, like mplfinance's Renko
+        positions = np.arange(len(bricks))
+        dates = bricks.index.strftime('%d %b %Y')
+        opens = bricks['Open'].to_numpy()
+        closes = bricks['Close'].to_numpy()
+        
+        fig = go.Figure(go.Bar(
+            x=positions,
+            y=closes - opens,
+            base=opens,
+            width=1.0,
+            marker_color=np.where(closes > opens, '#00C851', '#FF4444'),
+            marker_line_color='white',
+            marker_line_width=0.5,
+            customdata=np.column_stack([dates, opens, closes]),
+            hovertemplate="%{customdata[0]}<br>₹%{customdata[1]:.2f} → ₹%{customdata[2]:.2f}<extra></extra>"
+        ))
+        
+        # Label roughly eight bricks along the x axis with their dates
+        ticks = positions[::max(1, len(positions) // 8)]
+        fig.update_layout(
             title=f"Renko Chart - {symbol} (Brick Size: {brick_size_pct}%)",
-            figsize=(12, 6),
-            returnfig=True
+            height=500,
+            bargap=0,
+            showlegend=False,
+            xaxis=dict(tickmode='array', tickvals=ticks, ticktext=dates[ticks]),
+            yaxis_title="Price (₹)",
+            margin=dict(l=40, r=20, t=60, b=40)
         )
         
         return fig
@@ -158,12 +256,63 @@ def create_renko_chart(data, symbol, brick_size_pct=1.0):
         st.error(f"Error creating Renko chart: {str(e)}")
         return None
 
+# The candlestick chart is cached as rendered PNG bytes, so reruns send the
+# bytes instead of re-serializing the Matplotlib figure
+@st.cache_data(ttl=300, hash_funcs={pd.DataFrame: chart_data_key})
+def create_candlestick_chart(data, symbol, period, timeframe):
+    """Create candlestick chart with 20/50 SMAs using mplfinance, returned as PNG bytes"""
+    # Imported here since only the Analysis tab draws candlesticks and
+    # matplotlib is slow to import
+    import mplfinance as mpf
+
+    # Calculate moving averages
+    smas = calculate_smas(symbol, period)
+    sma_20 = smas.get(20)
+    sma_50 = smas.get(50)
+    
+    # Create addplots for moving averages
+    apds = []
+    if sma_20 is not None:
+        apds.append(mpf.make_addplot(sma_20, color='#FF6B35', width=2))
+    if sma_50 is not None:
+        apds.append(mpf.make_addplot(sma_50, color='#004E89', width=2))
+    
+    # Custom style for cleaner look
+    mc = mpf.make_marketcolors(
+        up='#00C851',
+        down='#FF4444', 
+        edge='inherit',
+        wick={'up':'#00C851', 'down':'#FF4444'},
+        volume='in'
+    )
+    
+    s = mpf.make_mpf_style(
+        marketcolors=mc,
+        gridstyle='-',
+        gridcolor='#E0E0E0',
+        facecolor='white',
+        figcolor='white'
+    )
+    
+    # Create the candlestick chart
+    fig, axes = mpf.plot(
+        data,
+        type='candle',
+        style=s,
+        title=f"{symbol} - {timeframe} Analysis",
+        figsize=(12, 6),
+        addplot=apds if apds else None,
+        returnfig=True,
+        tight_layout=True
+    )
+    
+    return figure_to_png(fig)
+
 # Sidebar - Portfolio Summary
 with st.sidebar:
     st.header("📊 Portfolio Summary")
     
-    cash_balance = portfolio.get_cash_balance()
-    holdings_df = portfolio.get_holdings()
+    cash_balance = load_cash_balance(portfolio.version)
     
     # Get current prices for all holdings
     current_prices = {}
@@ -171,15 +320,11 @@ with st.sidebar:
     total_current = 0
     
     if not holdings_df.empty:
-        for symbol in holdings_df['symbol'].unique():
-            price = get_current_price(symbol)
-            current_prices[symbol] = price if price else 0
+        prices = get_current_prices(holding_symbols)
+        current_prices = {symbol: price if price else 0 for symbol, price in prices.items()}
         
-        for _, row in holdings_df.iterrows():
-            invested = row['quantity'] * row['avg_price']
-            current = row['quantity'] * current_prices.get(row['symbol'], 0)
-            total_invested += invested
-            total_current += current
+        total_invested = float((holdings_df['quantity'] * holdings_df['avg_price']).sum())
+        total_current = calculate_portfolio_value(holdings_df, current_prices)
     
     total_portfolio = cash_balance + total_current
     total_pnl = total_current - total_invested
@@ -201,7 +346,7 @@ with st.sidebar:
     
     # Export section
     st.write("**📥 Export Portfolio**")
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     
     with col1:
         if st.button("JSON Export", help="Download as single JSON file"):
@@ -228,15 +373,30 @@ with st.sidebar:
                 with col_c:
                     st.download_button("Cash CSV", cash_csv, f"cash_{timestamp}.csv", "text/csv")
     
+    with col3:
+        if st.button("Parquet Export", help="Download as compact single Parquet file"):
+            parquet_data = portfolio.export_data_parquet()
+            if parquet_data:
+                st.download_button(
+                    label="Download Parquet",
+                    data=parquet_data,
+                    file_name=f"portfolio_{datetime.now().strftime('%Y%m%d_%H%M')}.parquet",
+                    mime="application/octet-stream"
+                )
+    
     # Import section
     st.write("**📤 Import Portfolio**")
     import_type = st.radio("Import Type", ["JSON", "CSV"], horizontal=True)
     
     if import_type == "JSON":
-        uploaded_file = st.file_uploader("Upload JSON backup", type="json")
+        uploaded_file = st.file_uploader("Upload JSON or Parquet backup", type=["json", "parquet"])
         if uploaded_file:
-            json_data = uploaded_file.read().decode()
-            success, message = portfolio.import_data(json_data)
+            file_data = uploaded_file.read()
+            # Parquet files start with the 'PAR1' magic bytes
+            if file_data[:4] == b"PAR1":
+                success, message = portfolio.import_data_parquet(file_data)
+            else:
+                success, message = portfolio.import_data(file_data.decode())
             if success:
                 st.success(message)
                 st.rerun()
@@ -265,40 +425,54 @@ with st.sidebar:
 # st.title("📈 NSE Paper Trading App")
 # st.markdown("---")
 
-# Create tabs
-tab1, tab2, tab3, tab4 = st.tabs(["🔄 Trade", "💼 Holdings", "📋 Order Book", "📊 Analysis"])
+# Create tabs; switching tabs reruns the app and only the open tab's body runs
+tab1, tab2, tab3, tab4 = st.tabs(
+    TABS,
+    key="active_tab",
+    on_change="rerun"
+)
 
 # Tab 1 - Trade
-with tab1:
+# Runs as a fragment so editing the order form only reruns this tab;
+# executing an order still calls st.rerun() to refresh the whole app
+@st.fragment
+def trade_panel():
     col1, col2 = st.columns([1, 2])
 
-
-
-        # Stock selector with search
+    # Stock selector with search
     with col1:
         st.subheader("Place Order")
-        symbols = get_nifty_500_symbols()
-        selected_display = st.selectbox("Select Stock", symbols, key="trade_symbol")
+        restore_widget("trade_symbol", all_symbols[0])
+        selected_display = st.selectbox("Select Stock", all_symbols, key="trade_symbol")
+        remember_widget("trade_symbol")
         selected_symbol = extract_symbol(selected_display)
-        
+    
         # Get current price
-        current_price = get_current_price(selected_symbol)
-        if current_price:
+        live_price = get_current_price(selected_symbol)
+        if live_price:
+            current_price = live_price
             st.info(f"Current Price: ₹{current_price:.2f}")
         else:
             st.warning("Unable to fetch current price")
             current_price = 100.0  # Fallback
-    
+
 
         # Order type
-        order_type = st.radio("Order Type", ["BUY", "SELL"])
-        
-        # Quantity and price
-        quantity = st.number_input("Quantity", min_value=1, value=1)
+        restore_widget("order_type", "BUY")
+        order_type = st.radio("Order Type", ["BUY", "SELL"], key="order_type")
+        remember_widget("order_type")
+    
+        # Quantity and price; the price isn't keyed so it resets to the
+        # latest quote whenever the quote changes
+        restore_widget("order_quantity", 1)
+        quantity = st.number_input("Quantity", min_value=1, key="order_quantity")
+        remember_widget("order_quantity")
         price = st.number_input("Price (₹)", min_value=0.01, value=current_price, format="%.2f")
     
-    # Strategy tag
-        strategy = st.text_input("Strategy Tag (optional)", placeholder="e.g., Swing Trade, Breakout")
+        # Strategy tag
+        restore_widget("order_strategy", "")
+        strategy = st.text_input("Strategy Tag (optional)", placeholder="e.g., Swing Trade, Breakout", key="order_strategy")
+        remember_widget("order_strategy")
 
         # Total value
         total_value = quantity * price
@@ -310,7 +484,7 @@ with tab1:
                 success, message = portfolio.execute_buy_order(selected_symbol, quantity, price, strategy)
             else:
                 success, message = portfolio.execute_sell_order(selected_symbol, quantity, price, strategy)
-            
+        
             if success:
                 # Store success info in session state
                 st.session_state.order_success = {
@@ -335,220 +509,235 @@ with tab1:
             st.balloons()
             # Clear the success state
             del st.session_state.order_success
-    
 
-    
+
+
     # Renko Chart below order form
     st.subheader(f"📊 {selected_symbol} ")
-    
+
     hist_data = get_historical_data(selected_symbol, "1y")
     if hist_data is not None and not hist_data.empty:
-        current_price_display = get_current_price(selected_symbol)
+        current_price_display = live_price
         brick_size_pct = 1.0
         if current_price_display:
-            st.info(f"Current: ₹{current_price_display:.2f} | Brick: {brick_size_pct}% (₹{current_price_display * brick_size_pct / 100:.2f})")
-        
+            st.info(f"Current: ₹{current_price_display:.2f} | Brick: {brick_size_pct}% (₹{renko_brick_size(current_price_display, brick_size_pct):.2f})")
+    
         renko_fig = create_renko_chart(hist_data, selected_symbol, brick_size_pct)
-        
-        if renko_fig:
-            st.pyplot(renko_fig)
+    
+        if renko_fig is not None:
+            st.plotly_chart(renko_fig, key="trade_renko")
         else:
             st.warning("Unable to generate Renko chart")
     else:
         st.error("Unable to load chart data")
 
-# Tab 2 - Holdings
-with tab2:
-    st.subheader("💼 Current Holdings")
+with tab1:
+    if tab1.open:
+        trade_panel()
+
+# Holdings and Order Book watchlists run as fragments so picking a symbol
+# only redraws the watchlist and its chart
+@st.fragment
+def watchlist_chart(title, symbols, prices, key):
+    """Clickable watchlist with a Renko chart of the selected symbol"""
+    col1, col2 = st.columns([1, 3])
+    index_key = f"selected_{key}_idx"
     
-    holdings_df = portfolio.get_holdings()
+    # Reset the selected index if the list shrank
+    restore_widget(index_key, 0)
+    if st.session_state[index_key] >= len(symbols):
+        st.session_state[index_key] = 0
     
-    if holdings_df.empty:
-        st.info("No holdings found. Start trading to see your positions here.")
-    else:
-        # Prepare holdings display
-        display_data = []
-        
-        for _, row in holdings_df.iterrows():
-            symbol = row['symbol']
-            quantity = row['quantity']
-            avg_price = row['avg_price']
-            
-            current_price = current_prices.get(symbol, 0)
-            invested_value = quantity * avg_price
-            current_value = quantity * current_price
-            pnl = current_value - invested_value
-            pnl_pct = (pnl / invested_value * 100) if invested_value > 0 else 0
-            
-            display_data.append({
-                'Symbol': symbol,
-                'Quantity': quantity,
-                'Avg Price': f"₹{avg_price:.2f}",
-                'Current Price': f"₹{current_price:.2f}",
-                'Invested Value': f"₹{invested_value:,.2f}",
-                'Current Value': f"₹{current_value:,.2f}",
-                'P&L': f"₹{pnl:,.2f}",
-                'P&L %': f"{pnl_pct:.2f}%"
-            })
-        
-        df_display = pd.DataFrame(display_data)
-        st.dataframe(df_display, use_container_width=True)
-        
-        # Renko Chart for Holdings
-        st.subheader("📊 Renko Chart - Holdings Analysis")
+    def symbol_label(i):
+        current_price = prices.get(symbols[i])
+        price_display = f"₹{current_price:.2f}" if current_price else "N/A"
+        return f"{symbols[i]} - {price_display}"
+    
+    with col1:
+        # One radio for the whole list instead of a button per symbol
+        st.radio(title, range(len(symbols)), format_func=symbol_label, key=index_key)
+        remember_widget(index_key)
+    
+    with col2:
+        if not symbols:
+            st.info("No symbols available for chart analysis")
+            return
         
-        col1, col2 = st.columns([1, 3])
+        selected = symbols[st.session_state[index_key]]
         
-        with col1:
-            st.write("**Holdings Watchlist**")
+        # Display Renko chart for selected symbol
+        hist_data = get_historical_data(selected, "6mo")
+        if hist_data is not None and not hist_data.empty:
+            current_price = prices.get(selected)
+            brick_size_pct = 1.0
+            if current_price:
+                st.info(f"**{selected}** - Current: ₹{current_price:.2f} | Brick: {brick_size_pct}% (₹{renko_brick_size(current_price, brick_size_pct):.2f})")
             
-            # Initialize selected holding index
-            if 'selected_holding_idx' not in st.session_state:
-                st.session_state.selected_holding_idx = 0
+            renko_fig = create_renko_chart(hist_data, selected, brick_size_pct)
             
-            holding_symbols = holdings_df['symbol'].tolist()
-
-
-            if holding_symbols:
-                # Create watchlist container
-                watchlist_container = st.container()
-                
-                with watchlist_container:
-                    for i, symbol in enumerate(holding_symbols):
-                        # Get current price for display
-                        current_price = current_prices.get(symbol, 0)
-                        
-                        # Create clickable row
-                        if st.button(
-                            f"{symbol} - ₹{current_price:.2f}",
-                            key=f"holding_watch_{i}",
-                            use_container_width=True,
-                            type="primary" if i == st.session_state.selected_holding_idx else "secondary"
-                        ):
-                            st.session_state.selected_holding_idx = i
+            if renko_fig is not None:
+                st.plotly_chart(renko_fig, key=f"{key}_renko")
+            else:
+                st.warning("Unable to generate Renko chart")
+        else:
+            st.error("Unable to load data for Renko chart")
 
+# Tab 2 - Holdings
+with tab2:
+    if tab2.open:
+        st.subheader("💼 Current Holdings")
+    
+        if holdings_df.empty:
+            st.info("No holdings found. Start trading to see your positions here.")
+        else:
+            # Prepare holdings display
+            current_price = holdings_df['symbol'].map(current_prices).fillna(0)
+            invested_value = holdings_df['quantity'] * holdings_df['avg_price']
+            current_value = holdings_df['quantity'] * current_price
+            pnl = current_value - invested_value
+            pnl_pct = (pnl / invested_value * 100).where(invested_value > 0, 0)
+        
+            # Numbers stay numeric and are formatted by the browser via column_config,
+            # so every column sorts numerically
+            df_display = pd.DataFrame({
+                'Symbol': holdings_df['symbol'],
+                'Quantity': holdings_df['quantity'],
+                'Avg Price': holdings_df['avg_price'],
+                'Current Price': current_price,
+                'Invested Value': invested_value,
+                'Current Value': current_value,
+                'P&L': pnl,
+                'P&L %': pnl_pct
+            })
+            st.dataframe(
+                df_display,
+                width="stretch",
+                column_config={
+                    'Avg Price': st.column_config.NumberColumn(format="₹%.2f"),
+                    'Current Price': st.column_config.NumberColumn(format="₹%.2f"),
+                    'Invested Value': st.column_config.NumberColumn(format="₹%,.2f"),
+                    'Current Value': st.column_config.NumberColumn(format="₹%,.2f"),
+                    'P&L': st.column_config.NumberColumn(format="₹%,.2f"),
+                    'P&L %': st.column_config.NumberColumn(format="%.2f%%")
+                }
+            )
         
-        with col2:
-            if holding_symbols:
-                selected_holding = holding_symbols[st.session_state.selected_holding_idx]
-                
-                # Display Renko chart for selected holding
-                hist_data = get_historical_data(selected_holding, "6mo")
-                if hist_data is not None and not hist_data.empty:
-                    current_price = get_current_price(selected_holding)
-                    brick_size_pct = 1.0
-                    if current_price:
-                        st.info(f"**{selected_holding}** - Current: ₹{current_price:.2f} | Brick: {brick_size_pct}% (₹{current_price * brick_size_pct / 100:.2f})")
-
-                    renko_fig = create_renko_chart(hist_data, selected_holding, brick_size_pct)
-                    
-                    if renko_fig:
-                        st.pyplot(renko_fig)
-                    else:
-                        st.warning("Unable to generate Renko chart")
-                else:
-                    st.error("Unable to load data for Renko chart")
-            else:
-                st.info("No holdings available for chart analysis")
+            # Renko Chart for Holdings
+            st.subheader("📊 Renko Chart - Holdings Analysis")
+        
+            watchlist_chart("Holdings Watchlist", holdings_df['symbol'].tolist(), current_prices, "holding")
 
 # Tab 3 - Order Book
 with tab3:
-    st.subheader("📋 Order History")
+    if tab3.open:
+        st.subheader("📋 Order History")
     
-    orders_df = portfolio.get_orders()
+        orders_df = load_orders(portfolio.version)
     
-    if orders_df.empty:
-        st.info("No orders found. Place your first trade to see order history.")
-    else:
-        # Format orders for display
-        orders_display = orders_df.copy()
-        orders_display['Price'] = orders_display['price'].apply(lambda x: f"₹{x:.2f}")
-        orders_display['Total Value'] = (orders_display['quantity'] * orders_display['price']).apply(lambda x: f"₹{x:,.2f}")
-        
-        # Select columns for display
-        display_cols = ['timestamp', 'symbol', 'order_type', 'quantity', 'Price', 'Total Value', 'strategy', 'status']
-        orders_display = orders_display[display_cols]
-        orders_display.columns = ['Timestamp', 'Symbol', 'Type', 'Quantity', 'Price', 'Total Value', 'Strategy', 'Status']
-        
-        st.dataframe(orders_display, use_container_width=True)
+        if orders_df.empty:
+            st.info("No orders found. Place your first trade to see order history.")
+        else:
+            # Prices stay numeric; the browser formats them via column_config
+            orders_display = pd.DataFrame({
+                'Timestamp': orders_df['timestamp'],
+                'Symbol': orders_df['symbol'],
+                'Type': orders_df['order_type'],
+                'Quantity': orders_df['quantity'],
+                'Price': orders_df['price'],
+                'Total Value': orders_df['quantity'] * orders_df['price'],
+                'Strategy': orders_df['strategy'],
+                'Status': orders_df['status']
+            })
         
-        # Renko Chart for Order Book
-        st.subheader("📊 Renko Chart - Order Analysis")
+            st.dataframe(
+                orders_display,
+                width="stretch",
+                column_config={
+                    'Price': st.column_config.NumberColumn(format="₹%.2f"),
+                    'Total Value': st.column_config.NumberColumn(format="₹%,.2f")
+                }
+            )
         
-        col1, col2 = st.columns([1, 3])
+            # Renko Chart for Order Book
+            st.subheader("📊 Renko Chart - Order Analysis")
         
-        with col1:
-            st.write("**Order Symbols Watchlist**")
-            
-            # Initialize selected order symbol index
-            if 'selected_order_idx' not in st.session_state:
-                st.session_state.selected_order_idx = 0
-            
+            # Reuse sidebar prices and fetch only the symbols no longer held
             order_symbols = orders_df['symbol'].unique().tolist()
-            
-            if order_symbols:
-                # Create watchlist container
-                watchlist_container = st.container()
-                
-                with watchlist_container:
-                    for i, symbol in enumerate(order_symbols):
-                        # Get current price for display
-                        current_price = get_current_price(symbol)
-                        price_display = f"₹{current_price:.2f}" if current_price else "N/A"
-                        
-                        # Create clickable row
-                        if st.button(
-                            f"{symbol} - {price_display}",
-                            key=f"order_watch_{i}",
-                            use_container_width=True,
-                            type="primary" if i == st.session_state.selected_order_idx else "secondary"
-                        ):
-                            st.session_state.selected_order_idx = i
-
-
-        with col2:
-            if order_symbols:
-                selected_order_symbol = order_symbols[st.session_state.selected_order_idx]
-                
-                # Display Renko chart for selected symbol
-                hist_data = get_historical_data(selected_order_symbol, "6mo")
-                if hist_data is not None and not hist_data.empty:
-                    current_price = get_current_price(selected_order_symbol)
-                    brick_size_pct = 1.0
-                    if current_price:
-                        st.info(f"**{selected_order_symbol}** - Current: ₹{current_price:.2f} | Brick: {brick_size_pct}% (₹{current_price * brick_size_pct / 100:.2f})")
-                    
-                    renko_fig = create_renko_chart(hist_data, selected_order_symbol, brick_size_pct)
-                    
-                    if renko_fig:
-                        st.pyplot(renko_fig)
-                    else:
-                        st.warning("Unable to generate Renko chart")
-                else:
-                    st.error("Unable to load data for Renko chart")
-            else:
-                st.info("No order symbols available for chart analysis")
+            missing_symbols = tuple(sorted(set(order_symbols) - current_prices.keys()))
+            order_prices = {**get_current_prices(missing_symbols), **current_prices}
+        
+            watchlist_chart("Order Symbols Watchlist", order_symbols, order_prices, "order")
         
-        # Strategy analysis
-        if not orders_df.empty:
-            st.subheader("📊 Strategy Analysis")
+            # Strategy analysis
+            if not orders_df.empty:
+                st.subheader("📊 Strategy Analysis")
             
-            col1, col2, col3 = st.columns(3)
+                col1, col2, col3 = st.columns(3)
             
-            with col1:
-                total_orders = len(orders_df)
-                buy_orders = len(orders_df[orders_df['order_type'] == 'BUY'])
-                sell_orders = len(orders_df[orders_df['order_type'] == 'SELL'])
+                with col1:
+                    order_counts = orders_df['order_type'].value_counts()
+                    total_orders = len(orders_df)
+                    buy_orders = int(order_counts.get('BUY', 0))
+                    sell_orders = int(order_counts.get('SELL', 0))
                 
-                st.metric("Total Orders", total_orders)
-                st.metric("Buy Orders", buy_orders)
-                st.metric("Sell Orders", sell_orders)
+                    st.metric("Total Orders", total_orders)
+                    st.metric("Buy Orders", buy_orders)
+                    st.metric("Sell Orders", sell_orders)
+
+# Analysis charts run as a fragment so switching timeframe only redraws them
+@st.fragment
+def analysis_charts(analysis_symbol):
+    # Charts section at the top
+    st.subheader(f"📈 {analysis_symbol} - Charts")
+    current_price_display = get_current_price(analysis_symbol)
+    brick_size_pct = 1.0
+    if current_price_display:
+        st.info(
+            f"Current: ₹{current_price_display:.2f} | Brick: {brick_size_pct}% (₹{renko_brick_size(current_price_display, brick_size_pct):.2f})")
+
+    # Timeframe selector
+    restore_widget("analysis_timeframe", "6 Months")
+    timeframe = st.radio("Select Timeframe", ["6 Months", "1 Year"], horizontal=True, key="analysis_timeframe")
+    remember_widget("analysis_timeframe")
+    period = "6mo" if timeframe == "6 Months" else "1y"
+
+    # Get historical data based on selected timeframe
+    hist_data = get_historical_data(analysis_symbol, period)
+
+    # Renko Chart (moved to top)
+    st.write(f"**{timeframe} Renko Chart**")
+
+    if hist_data is not None and not hist_data.empty:
+        renko_fig = create_renko_chart(hist_data, analysis_symbol, brick_size_pct)
+
+        if renko_fig is not None:
+            st.plotly_chart(renko_fig, key="analysis_renko")
+        else:
+            st.warning("Unable to generate Renko chart")
+    else:
+        st.error("Unable to load data for Renko chart")
+
+    # Candlestick Chart with Moving Averages (moved to bottom)
+    st.write(f"**{timeframe} Chart with Moving Averages**")
+
+    if hist_data is not None and not hist_data.empty:
+        chart_png = create_candlestick_chart(hist_data, analysis_symbol, period, timeframe)
+
+        st.image(chart_png, width="stretch")
+    else:
+        st.error("Unable to load chart data")
+
+    # Fundamentals section below charts
+    st.subheader("📈 Fundamentals")
+
 
 # Tab 4 - Analysis
-with tab4:
+# Runs as a fragment so watchlist navigation doesn't rerun the rest of the app
+@st.fragment
+def analysis_panel():
     # Create TradingView-style layout
     col_watchlist, col_main = st.columns([1, 3])
-    
+
     with col_watchlist:
         # Add CSS for scrollable watchlist
         st.markdown("""
@@ -562,212 +751,99 @@ with tab4:
         }
         </style>
         """, unsafe_allow_html=True)
-        
+    
         # Search functionality
+        restore_widget("watchlist_search", "")
         search_query = st.text_input("Search stocks", placeholder="Type symbol...", key="watchlist_search")
-        
+        remember_widget("watchlist_search")
+    
         # Sort options
+        restore_widget("sort_option", "Alphabetical")
         sort_option = st.selectbox("Sort by", ["Alphabetical", "Volume (High to Low)", "Volume (Low to High)"], key="sort_option")
-        
-        # Get all stocks for watchlist
-        all_symbols = get_nifty_500_symbols()
-        
+        remember_widget("sort_option")
+    
         # Filter stocks based on search
         if search_query:
             filtered_stocks = [s for s in all_symbols if search_query.upper() in s.upper()]
         else:
             filtered_stocks = all_symbols  # Show all stocks by default
-        
+    
         # Sort stocks based on selection
         if sort_option.startswith("Volume"):
             if len(filtered_stocks) > 100:
                 st.warning("⚠️ Volume sorting for large lists may take time. Consider searching to narrow down first.")
-            
+        
             try:
                 with st.spinner("Sorting by volume..."):
-                    # Get volume data for sorting
-                    volume_data = {}
-                    for stock_display in filtered_stocks:
-                        symbol = extract_symbol(stock_display)
-                        hist_data = get_historical_data(symbol, "1d")
-                        if hist_data is not None and not hist_data.empty:
-                            volume_data[stock_display] = hist_data['Volume'].iloc[-1] if 'Volume' in hist_data.columns else 0
-                        else:
-                            volume_data[stock_display] = 0
+                    # Get volume data for sorting in one batched download
+                    symbols = tuple(extract_symbol(s) for s in filtered_stocks)
+                    volume_data = get_latest_volumes(symbols)
+                
+                    # Sort by volume, reusing the extracted symbols for the keys
+                    order = sorted(
+                        range(len(filtered_stocks)),
+                        key=lambda i: volume_data.get(symbols[i], 0),
+                        reverse=sort_option == "Volume (High to Low)"
+                    )
+                    filtered_stocks = [filtered_stocks[i] for i in order]
                     
-                    # Sort by volume
-                    if sort_option == "Volume (High to Low)":
-                        filtered_stocks = sorted(filtered_stocks, key=lambda x: volume_data.get(x, 0), reverse=True)
-                    else:  # Volume (Low to High)
-                        filtered_stocks = sorted(filtered_stocks, key=lambda x: volume_data.get(x, 0))
-                        
             except Exception as e:
                 st.error("Volume sorting failed, showing alphabetical order")
         # Alphabetical is default, no sorting needed as symbols are already sorted
-        
-        # Initialize selected stock index
-        if 'selected_analysis_idx' not in st.session_state:
-            st.session_state.selected_analysis_idx = 0
-        
+    
         # Reset index if out of bounds
-        if filtered_stocks and st.session_state.selected_analysis_idx >= len(filtered_stocks):
+        restore_widget("selected_analysis_idx", 0)
+        if st.session_state.selected_analysis_idx >= len(filtered_stocks):
             st.session_state.selected_analysis_idx = 0
+    
+        def step_selection(step):
+            if filtered_stocks:
+                st.session_state.selected_analysis_idx = (st.session_state.selected_analysis_idx + step) % len(filtered_stocks)
         
         # Navigation buttons at the top
         col_up, col_down = st.columns(2)
         with col_up:
-            if st.button("⬆️", key="analysis_up", use_container_width=True):
-                if filtered_stocks:
-                    st.session_state.selected_analysis_idx = (st.session_state.selected_analysis_idx - 1) % len(filtered_stocks)
-                    st.rerun()
+            st.button("⬆️", key="analysis_up", width="stretch", on_click=step_selection, args=(-1,))
         with col_down:
-            if st.button("⬇️", key="analysis_down", use_container_width=True):
-                if filtered_stocks:
-                    st.session_state.selected_analysis_idx = (st.session_state.selected_analysis_idx + 1) % len(filtered_stocks)
-                    st.rerun()
-        
+            st.button("⬇️", key="analysis_down", width="stretch", on_click=step_selection, args=(1,))
+    
         # Create watchlist
         if filtered_stocks:
-            # Use Streamlit's native container with height
+            # A single radio keeps the widget count constant however long the list is
             with st.container(height=400):
-                for i, stock_display in enumerate(filtered_stocks):
-                    symbol = extract_symbol(stock_display)
-                    
-                    # Create clickable stock row (no price fetching)
-                    if st.button(
-                        symbol,
-                        key=f"analysis_stock_{i}",
-                        use_container_width=True,
-                        type="primary" if i == st.session_state.selected_analysis_idx else "secondary"
-                    ):
-                        st.session_state.selected_analysis_idx = i
-                        st.rerun()
-            
+                st.radio(
+                    "Stocks",
+                    range(len(filtered_stocks)),
+                    format_func=lambda i: extract_symbol(filtered_stocks[i]),
+                    key="selected_analysis_idx",
+                    label_visibility="collapsed"
+                )
+                remember_widget("selected_analysis_idx")
+        
             # Get selected symbol
             selected_display = filtered_stocks[st.session_state.selected_analysis_idx]
             analysis_symbol = extract_symbol(selected_display)
         else:
             analysis_symbol = "RELIANCE"
-    
-    with col_main:
-        # Charts section at the top
-        st.subheader(f"📈 {analysis_symbol} - Charts")
-        if current_price_display:
-            st.info(
-                f"Current: ₹{current_price_display:.2f} | Brick: {brick_size_pct}% (₹{current_price_display * brick_size_pct / 100:.2f})")
-
-        # Timeframe selector
-        timeframe = st.radio("Select Timeframe", ["6 Months", "1 Year"], horizontal=True)
-        period = "6mo" if timeframe == "6 Months" else "1y"
-        
-        # Get historical data based on selected timeframe
-        hist_data = get_historical_data(analysis_symbol, period)
 
-        # Renko Chart (moved to top)
-        st.write(f"**{timeframe} Renko Chart**")
-
-        if hist_data is not None and not hist_data.empty:
-            current_price_display = get_current_price(analysis_symbol)
-            brick_size_pct = 1.0
-
-            renko_fig = create_renko_chart(hist_data, analysis_symbol, brick_size_pct)
-
-            if renko_fig:
-                st.pyplot(renko_fig)
-            else:
-                st.warning("Unable to generate Renko chart")
-        else:
-            st.error("Unable to load data for Renko chart")
+    with col_main:
+        analysis_charts(analysis_symbol)
 
-        # Candlestick Chart with Moving Averages (moved to bottom)
-        st.write(f"**{timeframe} Chart with Moving Averages**")
-        
-        if hist_data is not None and not hist_data.empty:
-            # Prepare data for mplfinance
-            ohlcv = hist_data.copy()
-            
-            # If columns are multi-level, flatten them
-            if isinstance(ohlcv.columns, pd.MultiIndex):
-                ohlcv.columns = ohlcv.columns.droplevel(1)
-            
-            # Calculate moving averages
-            sma_20 = calculate_sma(hist_data, 20)
-            sma_50 = calculate_sma(hist_data, 50)
-            
-            # Create addplots for moving averages
-            apds = []
-            if sma_20 is not None:
-                apds.append(mpf.make_addplot(sma_20, color='#FF6B35', width=2))
-            if sma_50 is not None:
-                apds.append(mpf.make_addplot(sma_50, color='#004E89', width=2))
-            
-            # Custom style for cleaner look
-            mc = mpf.make_marketcolors(
-                up='#00C851',
-                down='#FF4444', 
-                edge='inherit',
-                wick={'up':'#00C851', 'down':'#FF4444'},
-                volume='in'
-            )
-            
-            s = mpf.make_mpf_style(
-                marketcolors=mc,
-                gridstyle='-',
-                gridcolor='#E0E0E0',
-                facecolor='white',
-                figcolor='white'
-            )
-            
-            # Create the candlestick chart
-            fig, axes = mpf.plot(
-                ohlcv,
-                type='candle',
-                style=s,
-                title=f"{analysis_symbol} - {timeframe} Analysis",
-                figsize=(12, 6),
-                addplot=apds if apds else None,
-                returnfig=True,
-                tight_layout=True
-            )
-            
-            st.pyplot(fig)
-        else:
-            st.error("Unable to load chart data")
-        
-        # Fundamentals section below charts
-        st.subheader("📈 Fundamentals")
-    
     fundamentals = get_stock_fundamentals(analysis_symbol)
-    
+
     if fundamentals:
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            if fundamentals.get('pe_ratio'):
-                st.metric("P/E Ratio", f"{fundamentals['pe_ratio']:.2f}")
-            if fundamentals.get('market_cap'):
-                st.metric("Market Cap", format_inr(fundamentals['market_cap']))
-        
-        with col2:
-            if fundamentals.get('pb_ratio'):
-                st.metric("P/B Ratio", f"{fundamentals['pb_ratio']:.2f}")
-            if fundamentals.get('roe'):
-                st.metric("ROE", f"{fundamentals['roe']*100:.2f}%")
-        
-        with col3:
-            if fundamentals.get('debt_equity'):
-                st.metric("Debt/Equity", f"{fundamentals['debt_equity']:.2f}")
-            if fundamentals.get('dividend_yield'):
-                st.metric("Dividend Yield", f"{fundamentals['dividend_yield']*100:.2f}%")
-        
-        with col4:
-            if fundamentals.get('week_52_high'):
-                st.metric("52W High", f"₹{fundamentals['week_52_high']:.2f}")
-            if fundamentals.get('week_52_low'):
-                st.metric("52W Low", f"₹{fundamentals['week_52_low']:.2f}")
+        for col, metrics in zip(st.columns(4), FUNDAMENTAL_METRICS):
+            with col:
+                for key, label, formatter in metrics:
+                    if fundamentals.get(key):
+                        st.metric(label, formatter(fundamentals[key]))
     else:
         st.warning("Unable to fetch fundamental data")
 
+with tab4:
+    if tab4.open:
+        analysis_panel()
+
 # Footer
 st.markdown("---")
 st.markdown("**Disclaimer:** This is a paper trading application for educational purposes only. Not for real trading.")
@@ -1,91 +1,313 @@
 import yfinance as yf
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime, timedelta, date, time
+from zoneinfo import ZoneInfo
 import warnings
 import requests
 import os
+import glob
+import json
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 warnings.filterwarnings('ignore')
 
-@st.cache_data(ttl=86400)  # 24 hour cache for historical data
-def get_historical_data(symbol, period="3y"):
-    """Fetch historical OHLC data for NSE stocks"""
-    try:
-        # Add .NS suffix for NSE stocks
-        ticker = f"{symbol}.NS"
-        stock = yf.Ticker(ticker)
-        data = stock.history(period=period)
+CACHE_DIR = 'cache'
+
+# Canonical column layout returned by get_historical_data
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# float32 is plenty for prices and halves the size of cached and charted frames
+PRICE_DTYPES = dict.fromkeys(['Open', 'High', 'Low', 'Close'], 'float32')
+INT32_MAX = np.iinfo(np.int32).max
+
+# NSE regular trading session
+MARKET_TZ = ZoneInfo('Asia/Kolkata')
+MARKET_OPEN = time(9, 15)
+MARKET_CLOSE = time(15, 30)
+# Quotes keep refreshing for a while after the close, until the official close settles
+PRICE_SETTLE = time(16, 0)
+
+# Fundamentals fields that are always numeric (or None) once fetched
+NUMERIC_FUNDAMENTALS = (
+    'pe_ratio', 'pb_ratio', 'market_cap', 'roe', 'debt_equity', 'dividend_yield',
+    'week_52_high', 'week_52_low', 'avg_volume'
+)
+
+def daily_disk_cache(func):
+    """Persist a fetcher's result on disk for the day so it survives app restarts"""
+    signature = inspect.signature(func)
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = '_'.join(str(value) for value in bound.arguments.values())
+        prefix = os.path.join(CACHE_DIR, f"{func.__name__}_{key}")
+        path = f"{prefix}_{date.today()}"
         
-        if data.empty:
-            return None
+        try:
+            if os.path.exists(f"{path}.parquet"):
+                return pd.read_parquet(f"{path}.parquet")
+            if os.path.exists(f"{path}.json"):
+                with open(f"{path}.json") as f:
+                    return json.load(f)
+        except Exception:
+            pass  # Unreadable cache file, fall through to the network
         
-        # Flatten multi-level columns if they exist
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = data.columns.droplevel(1)
+        result = func(*args, **kwargs)
         
-        return data
+        # Only persist successful fetches so failures are retried
+        try:
+            if isinstance(result, pd.DataFrame) and not result.empty:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                result.to_parquet(f"{path}.parquet", compression='zstd')
+            elif isinstance(result, dict) and result:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(f"{path}.json", 'w') as f:
+                    json.dump(result, f)
+            else:
+                return result
+            
+            # Today's file replaces earlier days' files for the same call
+            for old_path in glob.glob(f"{glob.escape(prefix)}_????-??-??.*"):
+                if not old_path.startswith(path):
+                    os.remove(old_path)
+        except Exception:
+            pass  # Disk cache is best effort
+        
+        return result
+    
+    return wrapper
+
+class DataUnavailable(Exception):
+    """Raised when Yahoo returns no data, so the long-lived caches skip the result"""
+
+# Fetchers are split in two: the long-lived cache only ever stores successful
+# results, while the public wrapper caches failures (None) for a minute so a
+# delisted or rate-limited symbol isn't retried on every rerun
+
+@st.cache_data(ttl=86400, show_spinner=False)  # 24 hour cache; the public wrapper shows the spinner
+@daily_disk_cache
+def _fetch_historical_data(symbol, period):
+    # Add .NS suffix for NSE stocks
+    ticker = f"{symbol}.NS"
+    stock = yf.Ticker(ticker)
+    data = stock.history(period=period)
+    
+    if data.empty:
+        raise DataUnavailable(symbol)
+    
+    # Flatten multi-level columns if they exist and keep only OHLCV,
+    # so chart builders can use the frame as-is
+    if isinstance(data.columns, pd.MultiIndex):
+        data.columns = data.columns.get_level_values(0)
+    
+    data = data[OHLCV_COLUMNS].astype(PRICE_DTYPES)
+    
+    # Volume fits in int32 for almost every stock; keep int64 when it doesn't
+    volume = data['Volume'].fillna(0)
+    data['Volume'] = volume.astype('int32' if volume.max() <= INT32_MAX else 'int64')
+    
+    return data
+
+@st.cache_data(ttl=60)  # 1 minute cache, mainly for failed fetches
+def get_historical_data(symbol, period="3y"):
+    """Fetch historical OHLCV data for NSE stocks with Open/High/Low/Close/Volume columns"""
+    try:
+        return _fetch_historical_data(symbol, period)
+    except DataUnavailable:
+        return None
     except Exception as e:
         st.error(f"Error fetching historical data for {symbol}: {str(e)}")
         return None
 
-@st.cache_data(ttl=1800)  # 30 minute cache for current prices
+def price_cache_key():
+    """Cache key for prices: changes every minute while NSE is open and until the
+    closing price settles, then stays fixed for the rest of the day and again
+    until the next open, so closed-market prices aren't refetched"""
+    now = datetime.now(MARKET_TZ)
+    if now.weekday() < 5 and MARKET_OPEN <= now.time() < PRICE_SETTLE:
+        return now.strftime('%Y-%m-%d %H:%M')
+    
+    # Before the open the key must differ from after the close of the same day
+    return f"{now:%Y-%m-%d} {'pre-open' if now.time() < MARKET_OPEN else 'closed'}"
+
+# Freshness comes from price_cache_key. Its key changes every minute during market
+# hours, so max_entries evicts the stale minutes instead of holding them for a day
+@st.cache_data(ttl=86400, max_entries=1000, show_spinner=False)
+def _fetch_current_price(symbol, cache_key):
+    # The latest daily close is the current price during market hours; it is a
+    # far smaller download than stock.info. Five days covers weekends and holidays
+    ticker = f"{symbol}.NS"
+    hist = yf.Ticker(ticker).history(period="5d")
+    
+    if not hist.empty:
+        return float(hist['Close'].iloc[-1])
+    
+    raise DataUnavailable(symbol)
+
+@st.cache_data(ttl=60)  # 1 minute cache, mainly for failed fetches
 def get_current_price(symbol):
     """Fetch current price for NSE stock"""
     try:
-        ticker = f"{symbol}.NS"
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        
-        # Try different price fields
-        current_price = info.get('currentPrice') or info.get('regularMarketPrice') or info.get('previousClose')
-        
-        if current_price:
-            return float(current_price)
-        
-        # Fallback: get latest close from history
-        hist = stock.history(period="1d")
-        if not hist.empty:
-            return float(hist['Close'].iloc[-1])
-            
+        return _fetch_current_price(symbol, price_cache_key())
+    except DataUnavailable:
         return None
     except Exception as e:
         st.warning(f"Error fetching current price for {symbol}: {str(e)}")
         return None
 
+def _current_price_or_none(symbol, cache_key):
+    # Runs on worker threads, which can't show warnings, so failures are just None
+    try:
+        return _fetch_current_price(symbol, cache_key)
+    except Exception:
+        return None
+
+@st.cache_data(ttl=60, show_spinner=False)  # 1 minute cache for batched prices
+def get_current_prices(symbols):
+    """Fetch current prices for several NSE stocks with one batched download"""
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    
+    prices = {}
+    try:
+        tickers = [f"{symbol}.NS" for symbol in symbols]
+        data = yf.download(tickers, period="1d", group_by="ticker", threads=True, progress=False)
+        
+        for symbol, ticker in zip(symbols, tickers):
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                closes = data[ticker]['Close'].dropna()
+            else:
+                closes = data['Close'].dropna()
+            
+            if not closes.empty:
+                prices[symbol] = float(closes.iloc[-1])
+    except Exception:
+        pass  # Fall back to per-symbol lookups below
+    
+    # Symbols missing from the batch fall back to concurrent per-symbol lookups
+    missing = [symbol for symbol in symbols if symbol not in prices]
+    if missing:
+        cache_key = price_cache_key()
+        with ThreadPoolExecutor(max_workers=min(32, len(missing))) as executor:
+            prices.update(zip(missing, executor.map(_current_price_or_none, missing, [cache_key] * len(missing))))
+    
+    return {symbol: prices[symbol] for symbol in symbols}
+
+@st.cache_data(ttl=600, show_spinner=False)  # 10 minute cache for volume sorting
+def get_latest_volumes(symbols):
+    """Fetch the latest traded volume for several NSE stocks with one batched download"""
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    
+    volumes = {}
+    try:
+        tickers = [f"{symbol}.NS" for symbol in symbols]
+        data = yf.download(tickers, period="2d", group_by="ticker", threads=True, progress=False)
+        
+        for symbol, ticker in zip(symbols, tickers):
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                volume = data[ticker]['Volume'].dropna()
+            else:
+                volume = data['Volume'].dropna()
+            
+            if not volume.empty:
+                volumes[symbol] = float(volume.iloc[-1])
+    except Exception as e:
+        st.warning(f"Error fetching volumes: {str(e)}")
+    
+    return volumes
+
+def prefetch(calls):
+    """Warm fetcher caches by running independent calls concurrently
+
+    Worker threads must not emit UI, so pass the private _fetch_* functions
+    rather than their public wrappers. Failures are dropped here and reported
+    by the public call that later reads the same cache.
+    """
+    if not calls:
+        return
+    
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        futures = [executor.submit(func, *args) for func, *args in calls]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+
 @st.cache_data(ttl=86400)  # 24 hour cache for fundamentals
+@daily_disk_cache
+def _fetch_stock_fundamentals(symbol):
+    ticker = f"{symbol}.NS"
+    stock = yf.Ticker(ticker)
+    info = stock.info
+    
+    fundamentals = {
+        'pe_ratio': info.get('trailingPE'),
+        'pb_ratio': info.get('priceToBook'),
+        'market_cap': info.get('marketCap'),
+        'roe': info.get('returnOnEquity'),
+        'debt_equity': info.get('debtToEquity'),
+        'dividend_yield': info.get('dividendYield'),
+        'week_52_high': info.get('fiftyTwoWeekHigh'),
+        'week_52_low': info.get('fiftyTwoWeekLow'),
+        'avg_volume': info.get('averageVolume'),
+        'sector': info.get('sector'),
+        'industry': info.get('industry')
+    }
+    
+    # Yahoo occasionally returns strings like 'Infinity' for ratios;
+    # normalize numeric fields here so the UI can format them directly
+    for key in NUMERIC_FUNDAMENTALS:
+        value = fundamentals[key]
+        fundamentals[key] = float(value) if isinstance(value, (int, float)) else None
+    
+    return fundamentals
+
+@st.cache_data(ttl=60)  # 1 minute cache, mainly for failed fetches
 def get_stock_fundamentals(symbol):
     """Fetch fundamental data for NSE stock"""
     try:
-        ticker = f"{symbol}.NS"
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        
-        fundamentals = {
-            'pe_ratio': info.get('trailingPE'),
-            'pb_ratio': info.get('priceToBook'),
-            'market_cap': info.get('marketCap'),
-            'roe': info.get('returnOnEquity'),
-            'debt_equity': info.get('debtToEquity'),
-            'dividend_yield': info.get('dividendYield'),
-            'week_52_high': info.get('fiftyTwoWeekHigh'),
-            'week_52_low': info.get('fiftyTwoWeekLow'),
-            'avg_volume': info.get('averageVolume'),
-            'sector': info.get('sector'),
-            'industry': info.get('industry')
-        }
-        
-        return fundamentals
+        return _fetch_stock_fundamentals(symbol)
     except Exception as e:
         st.warning(f"Error fetching fundamentals for {symbol}: {str(e)}")
         return {}
 
-def calculate_sma(data, window):
-    """Calculate Simple Moving Average"""
-    if data is not None and not data.empty:
-        return data['Close'].rolling(window=window).mean()
-    return None
+@st.cache_data(ttl=300)  # 5 minute cache for moving averages
+def calculate_smas(symbol, period, windows=(20, 50)):
+    """Calculate Simple Moving Averages for several windows from one Close series"""
+    data = get_historical_data(symbol, period)
+    if data is None or data.empty:
+        return {}
+    
+    # One cumulative sum serves every window: each SMA is a difference of two
+    # running totals. Summed in float64 so the float32 closes don't lose precision
+    close = data['Close'].to_numpy(dtype=np.float64)
+    csum = np.concatenate(([0.0], np.cumsum(close)))
+    
+    smas = {}
+    for window in windows:
+        sma = np.full(len(close), np.nan)
+        if len(close) >= window:
+            sma[window - 1:] = (csum[window:] - csum[:-window]) / window
+        smas[window] = pd.Series(sma, index=data.index)
+    return smas
 
-@st.cache_data(ttl=86400)  # 24 hour cache
+# The symbol tuple is immutable, so it is shared across reruns and sessions
+# as a resource instead of being unpickled on every access
+@st.cache_resource(ttl=86400, show_spinner=False)  # 24 hour cache
 def get_nifty_500_symbols():
     """Fetch NSE symbols from NSE website with local CSV fallback"""
     local_file = 'sec_list.csv'
@@ -97,18 +319,18 @@ def get_nifty_500_symbols():
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         
-        # Save to local file
+        # Save to local file as the offline fallback
         with open(local_file, 'wb') as f:
             f.write(response.content)
         
-        # Read and parse
-        df = pd.read_csv(local_file)
+        # Parse the downloaded bytes directly instead of re-reading the file
+        df = pd.read_csv(BytesIO(response.content), usecols=['Symbol', 'Series', 'Security Name'])
         # Filter for equity stocks only (Series = EQ)
         df = df[df['Series'] == 'EQ']
         # Create "Symbol - Name" format
         df['display'] = df['Symbol'] + ' - ' + df['Security Name']
         symbols = df['display'].dropna().unique().tolist()
-        return sorted(symbols)
+        return tuple(sorted(symbols))
         
     except Exception as e:
         # Fallback to local file
@@ -117,15 +339,16 @@ def get_nifty_500_symbols():
                 df = pd.read_csv(local_file)
                 df['display'] = df['Symbol'] + ' - ' + df['Security Name']
                 symbols = df['display'].dropna().unique().tolist()
-                return sorted(symbols)
+                return tuple(sorted(symbols))
             except:
                 pass
         
         # Final fallback to hardcoded list
-        return sorted([
+        return tuple(sorted([
             'RELIANCE - RELIANCE INDUSTRIES LIMITED',
-        ])
+        ]))
 
+@functools.lru_cache(maxsize=None)  # The symbol list is a few thousand entries at most
 def extract_symbol(display_text):
     """Extract symbol from 'SYMBOL - Company Name' format"""
     return display_text.split(' - ')[0] if ' - ' in display_text else display_text
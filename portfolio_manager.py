@@ -4,18 +4,42 @@ from datetime import datetime
 import streamlit as st
 import json
 import os
-from io import StringIO
+import threading
+from io import StringIO, BytesIO
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; JSON export/import then use the stdlib
+    orjson = None
 
 class PortfolioManager:
     def __init__(self, db_path="trading.db"):
         self.db_path = db_path
+        self.version = 0  # Bumped on every write so callers can cache reads per version
+        self._version_lock = threading.Lock()  # Shared by every session's script thread
         self.init_database()
     
+    def _bump_version(self):
+        """Bump the write version and return the new value"""
+        with self._version_lock:
+            self.version += 1
+            return self.version
+    
+    def _connect(self):
+        """Open a connection to the portfolio database"""
+        conn = sqlite3.connect(self.db_path)
+        # With WAL, NORMAL only syncs at checkpoints instead of on every commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
     def init_database(self):
         """Initialize database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # WAL is stored in the database file, so setting it once is enough
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Create holdings table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS holdings (
@@ -39,6 +63,10 @@ class PortfolioManager:
             )
         ''')
         
+        # Order history is read newest-first and per symbol
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders (timestamp DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_symbol_timestamp ON orders (symbol, timestamp DESC)')
+        
         # Create cash_balance table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS cash_balance (
@@ -53,6 +81,7 @@ class PortfolioManager:
             cursor.execute('INSERT INTO cash_balance (id, balance) VALUES (1, 500000.0)')
         
         conn.commit()
+        self._bump_version()
         conn.close()
         
         # Try to restore from backup if database is empty
@@ -60,7 +89,7 @@ class PortfolioManager:
     
     def get_cash_balance(self):
         """Get current cash balance"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         cursor.execute('SELECT balance FROM cash_balance WHERE id = 1')
         balance = cursor.fetchone()[0]
@@ -69,10 +98,11 @@ class PortfolioManager:
     
     def update_cash_balance(self, new_balance):
         """Update cash balance"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         cursor.execute('UPDATE cash_balance SET balance = ? WHERE id = 1', (new_balance,))
         conn.commit()
+        self._bump_version()
         conn.close()
     
     def execute_buy_order(self, symbol, quantity, price, strategy=""):
@@ -83,38 +113,42 @@ class PortfolioManager:
         if current_cash < total_cost:
             return False, "Insufficient funds"
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
-            # Check if holding exists
+            # Create the holding, or add to it and re-average its price, in one statement
+            cursor.execute('''INSERT INTO holdings (symbol, quantity, avg_price) VALUES (?, ?, ?)
+                             ON CONFLICT (symbol) DO UPDATE SET
+                                 avg_price = (holdings.quantity * holdings.avg_price + excluded.quantity * excluded.avg_price)
+                                             / (holdings.quantity + excluded.quantity),
+                                 quantity = holdings.quantity + excluded.quantity''',
+                          (symbol, quantity, price))
+            
+            # Read the updated holding back in the same transaction for the backup
+            # patch (RETURNING would need SQLite 3.35+)
             cursor.execute('SELECT quantity, avg_price FROM holdings WHERE symbol = ?', (symbol,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing holding
-                old_qty, old_avg = existing
-                new_qty = old_qty + quantity
-                new_avg = ((old_qty * old_avg) + (quantity * price)) / new_qty
-                cursor.execute('UPDATE holdings SET quantity = ?, avg_price = ? WHERE symbol = ?',
-                             (new_qty, new_avg, symbol))
-            else:
-                # Create new holding
-                cursor.execute('INSERT INTO holdings (symbol, quantity, avg_price) VALUES (?, ?, ?)',
-                             (symbol, quantity, price))
+            new_qty, new_avg = cursor.fetchone()
             
             # Add order record
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             cursor.execute('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
                           (symbol, 'BUY', quantity, price, timestamp, 'EXECUTED', strategy))
+            order_id = cursor.lastrowid
             
             # Update cash balance
             new_cash = current_cash - total_cost
             cursor.execute('UPDATE cash_balance SET balance = ? WHERE id = 1', (new_cash,))
             
             conn.commit()
-            success = True
+            version = self._bump_version()
+            changes = {
+                'order': self._order_record(order_id, symbol, 'BUY', quantity, price, timestamp, strategy),
+                'holding': {'symbol': symbol, 'quantity': new_qty, 'avg_price': new_avg},
+                'cash_balance': new_cash,
+                'version': version
+            }
             return True, "Order executed successfully"
             
         except Exception as e:
@@ -123,23 +157,23 @@ class PortfolioManager:
         finally:
             conn.close()
             # Auto-backup after successful order
-            if 'success' in locals():
-                self.backup_data()
+            if 'changes' in locals():
+                self.backup_data(changes)
     
     def execute_sell_order(self, symbol, quantity, price, strategy=""):
         """Execute sell order"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
             # Check holding
-            cursor.execute('SELECT quantity FROM holdings WHERE symbol = ?', (symbol,))
+            cursor.execute('SELECT quantity, avg_price FROM holdings WHERE symbol = ?', (symbol,))
             result = cursor.fetchone()
             
             if not result or result[0] < quantity:
                 return False, "Insufficient quantity to sell"
             
-            current_qty = result[0]
+            current_qty, avg_price = result
             
             # Update or remove holding
             if current_qty == quantity:
@@ -153,6 +187,7 @@ class PortfolioManager:
             cursor.execute('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
                           (symbol, 'SELL', quantity, price, timestamp, 'EXECUTED', strategy))
+            order_id = cursor.lastrowid
             
             # Update cash balance
             total_received = quantity * price
@@ -161,7 +196,14 @@ class PortfolioManager:
             cursor.execute('UPDATE cash_balance SET balance = ? WHERE id = 1', (new_cash,))
             
             conn.commit()
-            success = True
+            version = self._bump_version()
+            remaining = current_qty - quantity
+            changes = {
+                'order': self._order_record(order_id, symbol, 'SELL', quantity, price, timestamp, strategy),
+                'holding': {'symbol': symbol, 'quantity': remaining, 'avg_price': avg_price} if remaining else None,
+                'cash_balance': new_cash,
+                'version': version
+            }
             return True, "Order executed successfully"
             
         except Exception as e:
@@ -170,39 +212,68 @@ class PortfolioManager:
         finally:
             conn.close()
             # Auto-backup after successful order
-            if 'success' in locals():
-                self.backup_data()
+            if 'changes' in locals():
+                self.backup_data(changes)
     
     def get_holdings(self):
         """Get current holdings as DataFrame"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         df = pd.read_sql_query('SELECT * FROM holdings', conn)
         conn.close()
         return df
     
     def get_orders(self):
         """Get order history as DataFrame"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         df = pd.read_sql_query('SELECT * FROM orders ORDER BY timestamp DESC', conn)
         conn.close()
         return df
     
     def get_holding_quantity(self, symbol):
         """Get quantity of specific holding"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         cursor.execute('SELECT quantity FROM holdings WHERE symbol = ?', (symbol,))
         result = cursor.fetchone()
         conn.close()
         return result[0] if result else 0
     
-    def backup_data(self):
-        """Backup portfolio data to session state"""
+    @staticmethod
+    def _order_record(order_id, symbol, order_type, quantity, price, timestamp, strategy):
+        """An order as it appears in get_orders() records"""
+        return {
+            'id': order_id, 'symbol': symbol, 'order_type': order_type, 'quantity': quantity,
+            'price': price, 'timestamp': timestamp, 'status': 'EXECUTED', 'strategy': strategy
+        }
+    
+    def backup_data(self, changes=None):
+        """Backup portfolio data to session state
+        
+        After an order, pass its changes (order, holding, cash_balance, version)
+        to patch an existing backup instead of re-reading every table. The
+        manager is shared across sessions, so the backup is only patched when no
+        other write happened since it was taken.
+        """
         try:
+            backup = st.session_state.get('portfolio_backup')
+            if changes is not None and backup is not None and backup.get('version') == changes['version'] - 1:
+                order = changes['order']
+                backup['orders'].insert(0, order)
+                backup['holdings'] = [h for h in backup['holdings'] if h['symbol'] != order['symbol']]
+                if changes['holding'] is not None:
+                    backup['holdings'].append(changes['holding'])
+                backup['cash_balance'] = changes['cash_balance']
+                backup['version'] = changes['version']
+                backup['backup_time'] = datetime.now().isoformat()
+                return
+            
+            # Read the version first so a write landing mid-snapshot forces the next full one
+            version = self.version
             backup_data = {
                 'holdings': self.get_holdings().to_dict('records'),
                 'orders': self.get_orders().to_dict('records'),
                 'cash_balance': self.get_cash_balance(),
+                'version': version,
                 'backup_time': datetime.now().isoformat()
             }
             st.session_state['portfolio_backup'] = backup_data
@@ -222,26 +293,27 @@ class PortfolioManager:
                 return
             
             backup = st.session_state['portfolio_backup']
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Restore cash balance
             cursor.execute('UPDATE cash_balance SET balance = ? WHERE id = 1', (backup['cash_balance'],))
             
             # Restore holdings
-            for holding in backup['holdings']:
-                cursor.execute('''INSERT OR REPLACE INTO holdings (symbol, quantity, avg_price) 
+            cursor.executemany('''INSERT OR REPLACE INTO holdings (symbol, quantity, avg_price) 
                                  VALUES (?, ?, ?)''',
-                              (holding['symbol'], holding['quantity'], holding['avg_price']))
+                              [(holding['symbol'], holding['quantity'], holding['avg_price'])
+                               for holding in backup['holdings']])
             
             # Restore orders
-            for order in backup['orders']:
-                cursor.execute('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
+            cursor.executemany('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                              (order['symbol'], order['order_type'], order['quantity'], 
-                               order['price'], order['timestamp'], order['status'], order.get('strategy', '')))
+                              [(order['symbol'], order['order_type'], order['quantity'], 
+                                order['price'], order['timestamp'], order['status'], order.get('strategy', ''))
+                               for order in backup['orders']])
             
             conn.commit()
+            self._bump_version()
             conn.close()
             st.success(f"✅ Portfolio restored from backup ({backup['backup_time'][:16]})")
             
@@ -257,6 +329,8 @@ class PortfolioManager:
                 'cash_balance': self.get_cash_balance(),
                 'export_time': datetime.now().isoformat()
             }
+            if orjson is not None:
+                return orjson.dumps(export_data, option=orjson.OPT_INDENT_2).decode()
             return json.dumps(export_data, indent=2)
         except Exception as e:
             st.error(f"Export failed: {str(e)}")
@@ -265,8 +339,52 @@ class PortfolioManager:
     def import_data(self, json_data):
         """Import portfolio data from JSON"""
         try:
-            data = json.loads(json_data)
-            conn = sqlite3.connect(self.db_path)
+            data = orjson.loads(json_data) if orjson is not None else json.loads(json_data)
+            return self._import_records(data, "JSON")
+        except Exception as e:
+            return False, f"JSON import failed: {str(e)}"
+    
+    def export_data_parquet(self):
+        """Export portfolio data as a single Parquet file for download"""
+        try:
+            # Parquet holds one table, so the three tables are stacked with a 'table' column
+            frames = {
+                'holdings': self.get_holdings(),
+                'orders': self.get_orders(),
+                'cash_balance': pd.DataFrame({'balance': [self.get_cash_balance()]})
+            }
+            combined = pd.concat(frames, names=['table']).reset_index(level='table').reset_index(drop=True)
+            
+            buffer = BytesIO()
+            combined.to_parquet(buffer, index=False, compression='zstd')
+            return buffer.getvalue()
+        except Exception as e:
+            st.error(f"Parquet export failed: {str(e)}")
+            return None
+    
+    def import_data_parquet(self, parquet_data):
+        """Import portfolio data from a Parquet export"""
+        try:
+            combined = pd.read_parquet(BytesIO(parquet_data))
+            tables = dict(tuple(combined.groupby('table')))
+            
+            # Stacking turned the integer columns into floats; restore them
+            empty = combined.iloc[0:0]
+            holdings = tables.get('holdings', empty).astype({'quantity': int})
+            orders = tables.get('orders', empty).astype({'quantity': int}).fillna({'strategy': ''})
+            data = {
+                'holdings': holdings[['symbol', 'quantity', 'avg_price']].to_dict('records'),
+                'orders': orders.to_dict('records'),
+                'cash_balance': float(tables['cash_balance']['balance'].iloc[0])
+            }
+            return self._import_records(data, "Parquet")
+        except Exception as e:
+            return False, f"Parquet import failed: {str(e)}"
+    
+    def _import_records(self, data, source):
+        """Replace portfolio data with the given holdings, orders and cash balance"""
+        try:
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Clear existing data
@@ -275,27 +393,28 @@ class PortfolioManager:
             cursor.execute('UPDATE cash_balance SET balance = ?', (data['cash_balance'],))
             
             # Import holdings
-            for holding in data['holdings']:
-                cursor.execute('''INSERT INTO holdings (symbol, quantity, avg_price) 
+            cursor.executemany('''INSERT INTO holdings (symbol, quantity, avg_price) 
                                  VALUES (?, ?, ?)''',
-                              (holding['symbol'], holding['quantity'], holding['avg_price']))
+                              [(holding['symbol'], holding['quantity'], holding['avg_price'])
+                               for holding in data['holdings']])
             
             # Import orders
-            for order in data['orders']:
-                cursor.execute('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
+            cursor.executemany('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                              (order['symbol'], order['order_type'], order['quantity'], 
-                               order['price'], order['timestamp'], order['status'], order.get('strategy', '')))
+                              [(order['symbol'], order['order_type'], order['quantity'], 
+                                order['price'], order['timestamp'], order['status'], order.get('strategy', ''))
+                               for order in data['orders']])
             
             conn.commit()
+            self._bump_version()
             conn.close()
             
             # Update backup
             self.backup_data()
-            return True, "Portfolio imported from JSON successfully"
+            return True, f"Portfolio imported from {source} successfully"
             
         except Exception as e:
-            return False, f"JSON import failed: {str(e)}"
+            return False, f"{source} import failed: {str(e)}"
     
     def export_data_csv(self):
         """Export portfolio data as CSV files"""
@@ -317,41 +436,20 @@ class PortfolioManager:
     def import_data_csv(self, holdings_csv, orders_csv, cash_csv):
         """Import portfolio data from CSV files"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Clear existing data
-            cursor.execute('DELETE FROM holdings')
-            cursor.execute('DELETE FROM orders')
-            
-            # Import cash balance
             cash_df = pd.read_csv(StringIO(cash_csv))
-            new_balance = float(cash_df['balance'].iloc[0])
-            cursor.execute('UPDATE cash_balance SET balance = ?', (new_balance,))
-            
-            # Import holdings
             holdings_df = pd.read_csv(StringIO(holdings_csv))
-            if not holdings_df.empty:
-                for _, row in holdings_df.iterrows():
-                    cursor.execute('''INSERT INTO holdings (symbol, quantity, avg_price) 
-                                     VALUES (?, ?, ?)''',
-                                  (row['symbol'], row['quantity'], row['avg_price']))
-            
-            # Import orders
             orders_df = pd.read_csv(StringIO(orders_csv))
-            if not orders_df.empty:
-                for _, row in orders_df.iterrows():
-                    cursor.execute('''INSERT INTO orders (symbol, order_type, quantity, price, timestamp, status, strategy)
-                                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                  (row['symbol'], row['order_type'], row['quantity'], 
-                                   row['price'], row['timestamp'], row['status'], row.get('strategy', '')))
             
-            conn.commit()
-            conn.close()
-            
-            # Update backup
-            self.backup_data()
-            return True, "Portfolio imported from CSV successfully"
+            # Empty strategy cells come back as NaN
+            if 'strategy' not in orders_df:
+                orders_df['strategy'] = ''
+            orders_df['strategy'] = orders_df['strategy'].fillna('')
             
+            data = {
+                'holdings': holdings_df.to_dict('records'),
+                'orders': orders_df.to_dict('records'),
+                'cash_balance': float(cash_df['balance'].iloc[0])
+            }
+            return self._import_records(data, "CSV")
         except Exception as e:
             return False, f"CSV import failed: {str(e)}"
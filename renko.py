@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the brick loop then runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+def renko_brick_size(price, brick_size_pct):
+    """Brick size as a percentage of price"""
+    return price * brick_size_pct / 100
+
+@njit(cache=True)
+def _brick_kernel(closes, brick_size, top, bottom):
+    # Each brick moves the last brick close a full brick towards the price,
+    # so the total price travel bounds how many bricks can form
+    travel = abs(closes[0] - top) + abs(closes[0] - bottom) + np.abs(np.diff(closes)).sum()
+    capacity = int(travel / brick_size) + 1
+    positions = np.empty(capacity, dtype=np.int64)
+    opens = np.empty(capacity, dtype=np.float64)
+    brick_closes = np.empty(capacity, dtype=np.float64)
+    k = 0
+
+    for i in range(closes.shape[0]):
+        close = closes[i]
+        while close >= top + brick_size:
+            positions[k] = i
+            opens[k] = top
+            brick_closes[k] = top + brick_size
+            bottom, top = top, top + brick_size
+            k += 1
+        while close <= bottom - brick_size:
+            positions[k] = i
+            opens[k] = bottom
+            brick_closes[k] = bottom - brick_size
+            top, bottom = bottom, bottom - brick_size
+            k += 1
+
+    return positions[:k], opens[:k], brick_closes[:k], top, bottom
+
+def build_bricks(closes, brick_size, top, bottom):
+    """Build Renko bricks from close prices, continuing from the last brick's top and bottom
+
+    A new brick forms once the close moves a full brick beyond the last brick,
+    so a reversal needs two bricks of movement. Returns the index of the close
+    that formed each brick, the brick opens and closes, and the new top/bottom.
+    """
+    closes = np.ascontiguousarray(closes, dtype=np.float64)
+    if closes.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), top, bottom
+    return _brick_kernel(closes, float(brick_size), float(top), float(bottom))
+
+def get_renko_bricks(closes, brick_size):
+    """Renko bricks for a close series as OHLC, indexed by the date each brick formed"""
+    first = float(closes.iloc[0])
+    positions, opens, brick_closes, _, _ = build_bricks(closes.to_numpy(), brick_size, first, first)
+    bricks = pd.DataFrame(
+        {'Open': opens, 'Close': brick_closes},
+        index=pd.DatetimeIndex(closes.index[positions])
+    )
+    bricks['High'] = bricks[['Open', 'Close']].max(axis=1)
+    bricks['Low'] = bricks[['Open', 'Close']].min(axis=1)
+    return bricks[['Open', 'High', 'Low', 'Close']]